@@ -1,5 +1,5 @@
 #!/bin/sh
-pip install pymssql sqlalchemy python-dotenv pandas tablulate
+pip install pymssql sqlalchemy python-dotenv numpy pandas
 touch ./.env
 echo "DBUSER=
 DBPASS=
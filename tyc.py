@@ -1,12 +1,27 @@
 import sys, getopt
+import os, re
+import math
+import csv
+import io
+import atexit
+import sqlite3
+import socket
+import json
 import time
+import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
+from contextlib import redirect_stdout, nullcontext
+import hashlib
 from datetime import datetime
 from dotenv import dotenv_values
-from sqlalchemy import create_engine, text, MetaData, Table, ForeignKey, func, or_, and_
+from sqlalchemy import create_engine, event, text, select, bindparam, case, cast, Date, Numeric, String, MetaData, Table, Column, Index, ForeignKey, extract, func, or_, and_
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker, relationship
+import numpy as np
 import pandas as pd
-from tabulate import tabulate
+from pandas.api.types import union_categoricals
 
 # docs
 # https://docs.sqlalchemy.org/en/14/orm/tutorial.html#querying
@@ -18,6 +33,137 @@ try:
 except ImportError as e:
         raise ImportError('python-dotenv is not installed, run `pip install python-dotenv`') 
 
+def load_profile(name = None):
+    """
+    Connection settings of a named profile from .env.<name>, or from .env without a name.
+    """
+    if name is None:
+        return ENV_CONFIG
+    path = '.env.{0}'.format(name)
+    if not os.path.exists(path):
+        raise ValueError('No connection profile "{0}", expected a {1} file'.format(name, path))
+    return dotenv_values(path)
+
+def list_profiles():
+    """
+    Names of the .env.<name> files that are connection profiles: plain names defining DBURL and DBNAME,
+    so templates, backups and editor swap files are skipped.
+    """
+    profiles = []
+    for path in sorted(os.listdir('.')):
+        match = re.fullmatch(r'\.env\.([\w-]+)', path)
+        if match is None or match.group(1) in PROFILE_EXCLUDED_NAMES:
+            continue
+        config = dotenv_values(path)
+        if config.get('DBURL') and config.get('DBNAME'):
+            profiles.append(match.group(1))
+    return profiles
+
+# .env.<name> files that are never connection profiles, see list_profiles
+PROFILE_EXCLUDED_NAMES = {'example', 'sample', 'template', 'bak', 'orig'}
+
+# tables used by the Manager; only these are reflected and cached
+MODEL_TABLES = ['User', 'Follower', 'BinanceMirrorEventLogs', 'UserRole', 'KycAttempts', 'Wallet', 'Transaction']
+SCHEMA_CACHE_DIR = '.schema_cache'
+
+# local SQLite mirror of the event logs and the tables needed to report on them, see Manager.sync_local_mirror
+MIRROR_PATH = 'tyc_mirror.db'
+MIRROR_TABLES = ['User', 'UserRole', 'Follower', 'BinanceMirrorEventLogs']
+MIRROR_BATCH_SIZE = 50000
+# credentials never leave the production database
+MIRROR_EXCLUDED_COLUMNS = {'PasswordHash', 'SecurityStamp', 'ConcurrencyStamp'}
+
+# presentation formats of report values, see Manager.present
+MONEY_FORMAT = '${:.2f}'
+PERCENT_FORMAT = '{:.2f}%'
+LNGROWTH_FORMAT = '{:.4f}'
+# raw DerivedPositionLnGrowth as shown by the original last-activity report
+RAW_PERCENT_FORMAT = '{}%'
+RATIO_FORMAT = '{:.3f}'
+# data layer: rows per read_sql chunk and columns stored as pandas categoricals, see Manager.read_frame
+FRAME_CHUNK_SIZE = 50000
+FRAME_CATEGORICAL = ['UserName']
+
+OUTPUT_FORMATS = ['table', 'csv', 'jsonl']
+TABLE_COLUMN_WIDTH = 12
+# rows per fetch when streaming results
+STREAM_BATCH_SIZE = 1000
+
+# max. values per IN list, SQL Server allows 2100 parameters per statement
+IN_CHUNK_SIZE = 1000
+
+# UserRole.RoleId values
+ROLE_TRADER = 3
+ROLE_FOLLOWER = 4
+
+# Transaction.WalletType values whose token is unlocked
+UNLOCKED_WALLET_TYPES = [0, 1]
+
+# KPIs of the SLT general status report in output order, see Manager.get_slt_general_status
+SLT_STATUS_KPIS = [
+    ('cnt_users', "{0} verified users as of {1}"),
+    ('cnt_users_basisid_kyc', "{0} users completed BasisId KYC successfully as of {1}"),
+    ('cnt_users_basisid_kyc_with_balance', "{0} users with TYC balance > 0 completed BasisId KYC successfully as of {1}"),
+    ('cnt_user_with_withdrawals', "{0} users already had at least one withdrawal as of {1}"),
+    ('cnt_users_basisid_kyc_withdrawn_all', "{0} users completed BasisId KYC successfully and withdrew everything as of {1}"),
+    ('sum_unlocked_tyc_wallets', "{0} TYC in total are unlocked available in wallets as of {1} (query to be refined)"),
+]
+
+# seconds Manager.follow_graph serves its graph before checking the User/Follower watermark again
+FOLLOW_GRAPH_CHECK_INTERVAL = 30
+
+# on-disk cache of report output, see ResultCache
+RESULT_CACHE_PATH = '.result_cache.db'
+RESULT_CACHE_TTL = 300
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# tables each cacheable report reads; an entry is recomputed once one of their watermarks moves
+EVENT_REPORT_TABLES = ['User', 'UserRole', 'BinanceMirrorEventLogs']
+WALLET_REPORT_TABLES = ['User', 'Wallet', 'Transaction']
+# columns reports filter or sum on that are updated in place, where MAX(Id) / COUNT(*) does not move;
+# their checksum is part of the table's watermark
+RESULT_CACHE_CHECKSUM_COLUMNS = {
+    'User': ['UserName', 'Deleted', 'EmailConfirmed', 'IsKycDone', 'IsBasisKycDone', 'IsFollowingAllowed'],
+    'UserRole': ['RoleId'],
+    'Follower': ['FollowedById', 'FollowedUserId', 'Deleted', 'FollowAmount'],
+    'KycAttempts': ['BasisIdStatus'],
+}
+CACHED_METHODS = {
+    'get_users_follow_allowed': ['User'],
+    'get_followers_of_trader': ['User', 'Follower'],
+    'get_profitloss_alltime': EVENT_REPORT_TABLES,
+    'get_top_traders_profitloss': EVENT_REPORT_TABLES,
+    'get_equity_curves': EVENT_REPORT_TABLES,
+    'get_hourly_profitloss': ['User', 'Follower', 'BinanceMirrorEventLogs'],
+    'get_top_traders_volume': EVENT_REPORT_TABLES,
+    'get_top_followers_volume': EVENT_REPORT_TABLES,
+    'get_top_traders_balance': EVENT_REPORT_TABLES,
+    'get_top_followers_balance_max': EVENT_REPORT_TABLES,
+    'get_top_followers_balance': EVENT_REPORT_TABLES,
+    'get_last_activity': EVENT_REPORT_TABLES,
+    'get_event_history': EVENT_REPORT_TABLES,
+    'get_network_stats': ['User', 'Follower'],
+    'get_network_followers': ['User', 'Follower'],
+    'get_cnt_users': ['User'],
+    'get_cnt_users_basisid_kyc': ['User'],
+    'get_cnt_users_basisid_kyc_with_balance': WALLET_REPORT_TABLES,
+    'get_cnt_user_with_withdrawals': WALLET_REPORT_TABLES,
+    'get_cnt_users_basisid_kyc_withdrawn_all': WALLET_REPORT_TABLES,
+    'get_sum_unlocked_tyc_wallets': WALLET_REPORT_TABLES,
+    'get_slt_general_status': WALLET_REPORT_TABLES,
+    'supp_check': ['User', 'UserRole', 'KycAttempts', 'Wallet', 'Transaction'],
+}
+
+def native(value):
+    # numpy scalars as Python values, so JSON Lines keeps numbers as numbers
+    return value.item() if isinstance(value, np.generic) else value
+
+def format_yesno(flag):
+    return 'yes' if flag else 'no'
+
+def chunked(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
 def output_table(titles = [], rows = []):
     """
     output_tables(['names', 'weights', 'costs', 'unit_costs'], [[xx, xx], [xx, xx]])
@@ -33,10 +179,282 @@ def output_table(titles = [], rows = []):
 def output_pandas(headers = [], data = []):
     print(pd.DataFrame(data, headers))
 
+def output_stream(titles, rows, fmt = 'table', out = None):
+    """
+    Write rows (any iterable, consumed lazily) as a table, CSV or JSON Lines without buffering the result.
+    """
+    out = out or sys.stdout
+    if fmt == 'csv':
+        write = csv.writer(out).writerow
+        write(titles)
+    elif fmt == 'jsonl':
+        write = lambda row: out.write(json.dumps(dict(zip(map(str, titles), row)), default=str) + '\n')
+    elif fmt == 'table':
+        widths = [max(len(str(t)), TABLE_COLUMN_WIDTH) for t in titles]
+        write = lambda row: out.write('|'.join(str(x).ljust(w) for x, w in zip(row, widths)) + '\n')
+        write(titles)
+        out.write('-' * (sum(widths) + len(widths) - 1) + '\n')
+    else:
+        raise ValueError('Unknown output format "{0}", use one of {1}'.format(fmt, ', '.join(OUTPUT_FORMATS)))
+    for i, row in enumerate(rows):
+        write(row)
+        if i == 0:
+            out.flush()
+    out.flush()
+
+class ResultCache:
+    """
+    Output of report methods keyed by database, method, parameters and output format, stored in SQLite at path.
+    An entry is served while it is younger than ttl seconds and the watermarks of the tables the method reads
+    (MAX(Id), or COUNT(*) for tables without Id, plus a checksum of RESULT_CACHE_CHECKSUM_COLUMNS) are unchanged.
+    Updates to other columns are only picked up after ttl. Entries beyond max_bytes are evicted least recently used.
+    """
+
+    def __init__(self, path = RESULT_CACHE_PATH, ttl = RESULT_CACHE_TTL, max_bytes = RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("create table if not exists results (key text primary key, watermark text, value text, created real, last_used real)")
+
+    def key(self, m, methodname, args):
+        url = m.engine.url
+        return hashlib.sha1(repr((url.host, url.port, url.database, methodname, list(args), m.output)).encode('utf-8')).hexdigest()
+
+    def run(self, m, methodname, args, compute):
+        key = self.key(m, methodname, args)
+        watermark = m.watermark(CACHED_METHODS[methodname])
+        now = time.time()
+        row = self.db.execute("select value from results where key = ? and watermark = ? and created > ?", (key, watermark, now - self.ttl)).fetchone()
+        if row is not None:
+            self.hits += 1
+            with self.db:
+                self.db.execute("update results set last_used = ? where key = ?", (now, key))
+            sys.stdout.write(row[0])
+            return
+
+        self.misses += 1
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            compute()
+        value = buffer.getvalue()
+        sys.stdout.write(value)
+        with self.db:
+            self.db.execute("insert or replace into results values (?, ?, ?, ?, ?)", (key, watermark, value, now, now))
+            self.evict()
+
+    def evict(self):
+        total = 0
+        for key, size in self.db.execute("select key, length(value) from results order by last_used desc").fetchall():
+            total += size
+            if total > self.max_bytes:
+                self.db.execute("delete from results where key = ?", (key,))
+
+    def report(self):
+        print('Result cache: {0} hits, {1} misses'.format(self.hits, self.misses))
+
+class ProfiledCursor:
+    """
+    DB-API cursor wrapper adding fetch time, row count and approximate bytes of everything fetched to a QueryProfiler record.
+    """
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _fetched(self, rows, started_at):
+        self._record['fetch_s'] += time.perf_counter() - started_at
+        self._record['rows'] += len(rows)
+        self._record['bytes'] += sum(sys.getsizeof(value) for row in rows for value in row)
+        return rows
+
+    def fetchone(self):
+        started_at = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched([] if row is None else [row], started_at)
+        return row
+
+    def fetchmany(self, *args):
+        started_at = time.perf_counter()
+        return self._fetched(self._cursor.fetchmany(*args), started_at)
+
+    def fetchall(self):
+        started_at = time.perf_counter()
+        return self._fetched(self._cursor.fetchall(), started_at)
+
+class QueryProfiler:
+    """
+    Records every statement executed on an engine (and so on every session bound to it) with its SQL, parameters,
+    execution time, fetch time, rows and bytes, attributed to the Manager method running at the time.
+    With explain_slowest > 0 the query plans of the slowest SELECTs are captured as well.
+    """
+
+    def __init__(self, engine, explain_slowest = 0):
+        self.engine = engine
+        self.explain_slowest = explain_slowest
+        self.method = None
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # see https://docs.sqlalchemy.org/en/14/faq/performance.html#query-profiling
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        record = {'method': self.method, 'statement': statement, 'parameters': parameters,
+            'execute_s': time.perf_counter() - conn.info['query_start_time'].pop(-1), 'fetch_s': 0.0, 'rows': 0, 'bytes': 0}
+        self.statements.append(record)
+        if cursor.description is not None:
+            # the result is built from context.cursor after this event, so every fetch goes through the wrapper
+            context.cursor = ProfiledCursor(cursor, record)
+
+    def explain(self, record):
+        # a raw DB-API connection bypasses the engine events, so plans are not profiled themselves
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if self.engine.dialect.name == 'mssql':
+                cursor.execute('SET SHOWPLAN_XML ON')
+                try:
+                    cursor.execute(record['statement'], record['parameters'])
+                    return cursor.fetchall()[0][0]
+                finally:
+                    cursor.execute('SET SHOWPLAN_XML OFF')
+            elif self.engine.dialect.name == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + record['statement'], record['parameters'])
+                return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+        finally:
+            conn.close()
+
+    def summary(self):
+        methods = {}
+        for record in self.statements:
+            total = methods.setdefault(record['method'], {'method': record['method'], 'statements': 0, 'execute_s': 0.0, 'fetch_s': 0.0, 'rows': 0, 'bytes': 0})
+            total['statements'] += 1
+            for key in ('execute_s', 'fetch_s', 'rows', 'bytes'):
+                total[key] += record[key]
+        return list(methods.values())
+
+    def finish(self, path = None):
+        """
+        Capture plans if requested, print the per-method summary to stderr and export everything as JSON to path.
+        """
+        slowest = sorted(self.statements, key=lambda r: r['execute_s'] + r['fetch_s'], reverse=True)
+        for record in slowest[:self.explain_slowest]:
+            if record['statement'].lstrip().lower().startswith(('select', 'with')):
+                record['plan'] = self.explain(record)
+        output_stream(['Method', 'Statements', 'Execute s', 'Fetch s', 'Rows', 'Bytes'],
+            ((s['method'], s['statements'], '{:.3f}'.format(s['execute_s']), '{:.3f}'.format(s['fetch_s']), s['rows'], s['bytes']) for s in self.summary()),
+            out=sys.stderr)
+        if path:
+            with open(path, 'w') as f:
+                json.dump({'summary': self.summary(), 'statements': self.statements}, f, indent=2, default=str)
+
+class FollowGraph:
+    """
+    Active copy-trading edges (Follower rows with Deleted = 0) in CSR form over dense user indices: the followers of
+    trader t are indices[indptr[t]:indptr[t + 1]] with their FollowAmount at the same positions in amounts.
+    user_ids and usernames map dense indices back to User.Id and User.UserName.
+    """
+
+    def __init__(self, trader_ids, follower_ids, amounts, user_ids, usernames):
+        self.user_ids, inverse = np.unique(np.concatenate([user_ids, trader_ids, follower_ids]), return_inverse=True)
+        n = len(self.user_ids)
+        names = np.empty(n, dtype=object)
+        names[inverse[:len(user_ids)]] = usernames
+        self.usernames = names
+        self.index_by_name = {name: i for i, name in enumerate(names) if name is not None}
+
+        edges = inverse[len(user_ids):]
+        traders = edges[:len(trader_ids)]
+        followers = edges[len(trader_ids):]
+        order = np.argsort(traders, kind='stable')
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(traders, minlength=n), out=self.indptr[1:])
+        self.indices = followers[order].astype(np.int32)
+        self.amounts = np.asarray(amounts, dtype=float)[order]
+        self.edge_traders = traders[order].astype(np.int32)
+
+    def follower_counts(self):
+        return np.diff(self.indptr)
+
+    def aum(self):
+        return np.bincount(self.edge_traders, weights=self.amounts, minlength=len(self.user_ids))
+
+    def concentration(self):
+        # Herfindahl index of each trader's follow amounts: 1 means a single follower holds all of the AUM
+        aum = self.aum()
+        squares = np.bincount(self.edge_traders, weights=self.amounts ** 2, minlength=len(self.user_ids))
+        return np.divide(squares, aum ** 2, out=np.zeros_like(aum), where=aum > 0)
+
+    def traders_copied(self):
+        return np.bincount(self.indices, minlength=len(self.user_ids))
+
+    def followers_of(self, tradername):
+        i = self.index_by_name.get(tradername)
+        if i is None:
+            return np.array([], dtype=object), np.array([])
+        edges = slice(self.indptr[i], self.indptr[i + 1])
+        return self.usernames[self.indices[edges]], self.amounts[edges]
+
+class MirrorText(TypeDecorator):
+    """
+    Text column for MSSQL types without a generic equivalent (uniqueidentifier, ...), stored as str.
+    """
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else str(value)
+
+class MissingTable:
+    """
+    Stands in for a model table the database lacks (e.g. Wallet in the local mirror); any use names the table.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def error(self):
+        return ValueError('Table "{0}" is not available in this database{1}'.format(self.name,
+            ' (the local mirror holds {0} only)'.format(', '.join(MIRROR_TABLES)) if self.name not in MIRROR_TABLES else ''))
+
+    def __getattr__(self, attr):
+        raise self.error()
+
 class Manager:
 
-    def __init__(self):
-        self.engine = create_engine('mssql+pymssql://{0}:{1}@{2}:{3}/{4}'.format(ENV_CONFIG["DBUSER"], ENV_CONFIG["DBPASS"], ENV_CONFIG["DBURL"], ENV_CONFIG["DBPORT"], ENV_CONFIG["DBNAME"]))
+    def __init__(self, refresh_schema = False, wallet_cache = False, local = False, output = 'table', result_cache = None, engine = None, profile = None, memory_budget = None):
+        if engine is not None:
+            # e.g. the synthetic SQLite database of tyc_bench.py
+            self.engine = engine
+        elif local:
+            # reports run against the mirror written by sync_local_mirror, no production I/O
+            self.engine = create_engine('sqlite:///{0}'.format(MIRROR_PATH))
+        else:
+            config = load_profile(profile)
+            self.engine = create_engine('mssql+pymssql://{0}:{1}@{2}:{3}/{4}'.format(config["DBUSER"], config["DBPASS"], config["DBURL"], config["DBPORT"], config["DBNAME"]))
+        self.profile = profile
+        self.refresh_schema = refresh_schema
+        self.wallet_cache = wallet_cache
+        self.output = output
+        self.result_cache = result_cache
+        self.profiler = None
+        # max. bytes read_frame may hold, None for no limit
+        self.memory_budget = memory_budget
+        # when set to a list, emit() collects (titles, rows) instead of writing them, see fanout
+        self.collected = None
+        # file the running session reads its commands from, see run_session
+        self.command_source = None
+        self._wallet_aggregate = None
+        self._wallet_table = None
+        self._follow_graph = None
+        self._follow_graph_watermark = None
+        self._follow_graph_checked = None
         self.metadata = MetaData()
         self.reflect_all_models()
         self.create_session()
@@ -46,8 +464,48 @@ class Manager:
         self.tbl_users = Table('User', self.metadata, autoload_with=self.engine)
         self.tbl_followers = Table('Follower', self.metadata, autoload_with=self.engine)
     
+    def schema_cache_path(self):
+        url = self.engine.url
+        name = '{0}_{1}_{2}.pickle'.format(url.host, url.port, url.database)
+        return os.path.join(SCHEMA_CACHE_DIR, re.sub(r'[^\w.-]', '_', name))
+
+    def schema_fingerprint(self):
+        """
+        Hash of the modify dates and column definitions of MODEL_TABLES; changes whenever one of them is altered.
+        """
+        q = text("select t.name, t.modify_date, c.column_id, c.name, c.system_type_id, c.max_length, c.is_nullable "
+                 "from sys.tables t join sys.columns c on c.object_id = t.object_id "
+                 "where t.name in :names order by t.name, c.column_id").\
+            bindparams(bindparam('names', expanding=True))
+        with self.engine.connect() as conn:
+            rows = conn.execute(q, {'names': MODEL_TABLES}).all()
+        return hashlib.sha1(repr([tuple(r) for r in rows]).encode('utf-8')).hexdigest()
+
+    def load_schema(self):
+        if self.engine.dialect.name != 'mssql':
+            # local databases are cheap to reflect and may hold only some of MODEL_TABLES
+            metadata = MetaData()
+            metadata.reflect(bind=self.engine, only=lambda name, md: name in MODEL_TABLES)
+            return metadata
+
+        path = self.schema_cache_path()
+        fingerprint = self.schema_fingerprint()
+        if not self.refresh_schema and os.path.exists(path):
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['fingerprint'] == fingerprint:
+                return cached['metadata']
+
+        metadata = MetaData()
+        metadata.reflect(bind=self.engine, only=MODEL_TABLES)
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump({'fingerprint': fingerprint, 'metadata': metadata}, f)
+        return metadata
+
     def reflect_all_models(self):
-        self.metadata.reflect(bind=self.engine)
+        # reflected tables come from the on-disk schema cache unless the schema changed or a refresh is forced
+        self.metadata = self.load_schema()
         # we can then produce a set of mappings from this MetaData.
         self.Base = automap_base(metadata=self.metadata)
         # calling prepare() just sets up mapped classes and relationships.
@@ -59,16 +517,178 @@ class Manager:
             print(mc)
         """
 
-        self.tbl_user, self.tbl_follower, self.tbl_bmel, self.tbl_user_role, self.tbl_kyc_attempts, self.tbl_wallet, self.tbl_transaction = self.Base.classes.User, self.Base.classes.Follower, self.Base.classes.BinanceMirrorEventLogs, self.Base.classes.UserRole, self.Base.classes.KycAttempts, self.Base.classes.Wallet, self.Base.classes.Transaction
+        # tables missing from a local mirror raise a clear error once a report touches them
+        self.tbl_user, self.tbl_follower, self.tbl_bmel, self.tbl_user_role, self.tbl_kyc_attempts, self.tbl_wallet, self.tbl_transaction = [getattr(self.Base.classes, name, None) or MissingTable(name) for name in MODEL_TABLES]
     
     def setup_relations(self):
         self.tbl_bmel.user = relationship("User", order_by=self.tbl_user.Id, back_populates="BinanceMirrorEventLogs")
     
     def create_session(self):
-        Session = sessionmaker(bind=self.engine)
-        self.dbsession = Session()
+        self.Session = sessionmaker(bind=self.engine)
+        self.dbsession = self.Session()
+
+    def table_checksum(self, table):
+        checked = [table.c[name] for name in RESULT_CACHE_CHECKSUM_COLUMNS.get(table.name, []) if name in table.c]
+        if not checked:
+            return None
+        if self.engine.dialect.name == 'mssql':
+            return func.checksum_agg(func.binary_checksum(*checked))
+        # elsewhere: every column with its own weight, every row weighted by its key; text columns only count
+        # with their length there, so a rename to a name of the same length goes unnoticed outside MSSQL
+        key = list(table.primary_key.columns)[0]
+        values = [func.length(col) if isinstance(col.type, String) else col for col in checked]
+        return func.total(key * sum(func.coalesce(value, 0) * (i + 1) for i, value in enumerate(values)))
+
+    def watermark(self, tables):
+        """
+        Changes whenever rows are added to or removed from tables, or RESULT_CACHE_CHECKSUM_COLUMNS are updated:
+        MAX(Id) (COUNT(*) for tables without Id) and the column checksum of each table, as a JSON string.
+        """
+        # one round trip for all tables; MAX(Id) is a primary key seek where MAX(DateCreated) would be a scan
+        columns = []
+        for name in tables:
+            if name not in self.metadata.tables:
+                raise MissingTable(name).error()
+            table = self.metadata.tables[name]
+            agg = func.max(table.c.Id) if 'Id' in table.c else func.count()
+            columns.append(select(agg).select_from(table).scalar_subquery().label(name))
+            checksum = self.table_checksum(table)
+            if checksum is not None:
+                columns.append(select(checksum).select_from(table).scalar_subquery().label(name + '_checksum'))
+        with self.engine.connect() as conn:
+            row = conn.execute(select(*columns)).one()
+        return json.dumps(list(row), default=str)
+
+    """Local mirror methods"""
+    def mirror_type(self, coltype):
+        # MSSQL specific types are stored with their generic equivalent in the mirror
+        if type(coltype).__name__ in ('MONEY', 'SMALLMONEY'):
+            return Numeric(19, 4)
+        try:
+            return coltype.as_generic()
+        except NotImplementedError:
+            return MirrorText()
+
+    def mirror_metadata(self):
+        local_metadata = MetaData()
+        for name in MIRROR_TABLES:
+            columns = [Column(c.name, self.mirror_type(c.type), primary_key=c.primary_key)
+                for c in self.metadata.tables[name].columns if c.name not in MIRROR_EXCLUDED_COLUMNS]
+            Table(name, local_metadata, *columns)
+        events = local_metadata.tables['BinanceMirrorEventLogs']
+        Index('ix_BinanceMirrorEventLogs_UserId_ExchangeTimeStamp', events.c.UserId, events.c.ExchangeTimeStamp)
+        return local_metadata
+
+    def sync_local_mirror(self, batch_size = MIRROR_BATCH_SIZE):
+        """
+        Mirror MIRROR_TABLES into the local SQLite file at MIRROR_PATH. BinanceMirrorEventLogs is append-only and
+        only rows above the local MAX(Id) watermark are fetched, in batches of batch_size; the other tables are small
+        and change in place (Follower.Deleted, roles), so they are copied in full.
+        """
+        print('Syncing local mirror {0}:'.format(MIRROR_PATH))
+        batch_size = int(batch_size)
+        local_engine = create_engine('sqlite:///{0}'.format(MIRROR_PATH))
+        local_metadata = self.mirror_metadata()
+        local_metadata.create_all(local_engine)
+
+        for name in MIRROR_TABLES:
+            local_table = local_metadata.tables[name]
+            remote_table = self.metadata.tables[name]
+            remote_columns = [remote_table.c[c.name] for c in local_table.columns]
+            copied = 0
+            if name == 'BinanceMirrorEventLogs':
+                with local_engine.connect() as local:
+                    watermark = local.execute(select(func.max(local_table.c.Id))).scalar()
+                while True:
+                    q = select(*remote_columns).order_by(remote_table.c.Id).limit(batch_size)
+                    if watermark is not None:
+                        q = q.where(remote_table.c.Id > watermark)
+                    with self.engine.connect() as remote:
+                        batch = remote.execute(q).all()
+                    if not batch:
+                        break
+                    # every batch commits on its own so an interrupted sync resumes from the last one
+                    with local_engine.begin() as local:
+                        local.execute(local_table.insert(), [dict(r._mapping) for r in batch])
+                    watermark = batch[-1].Id
+                    copied += len(batch)
+            else:
+                with local_engine.begin() as local, self.engine.connect() as remote:
+                    local.execute(local_table.delete())
+                    result = remote.execution_options(stream_results=True).execute(select(*remote_columns))
+                    for batch in result.partitions(batch_size):
+                        local.execute(local_table.insert(), [dict(r._mapping) for r in batch])
+                        copied += len(batch)
+            print('{0}: {1} rows copied'.format(name, copied))
+
+    """Columnar data layer"""
+    def compact_frame(self, df, dates = ()):
+        # native dtypes instead of strings: datetime64, categorical user names and the smallest integer type
+        for col in df.columns:
+            if col in dates:
+                df[col] = pd.to_datetime(df[col])
+            elif col in FRAME_CATEGORICAL:
+                df[col] = df[col].astype('category')
+            elif pd.api.types.is_integer_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], downcast='integer')
+        return df
+
+    def iter_frames(self, statement, dates = (), chunksize = STREAM_BATCH_SIZE):
+        """
+        Fetch statement as a sequence of compact DataFrame chunks of at most chunksize rows.
+        """
+        # stream_results only opens a server-side cursor on dialects that support one; pymssql and pysqlite
+        # (supports_server_side_cursors = False in SQLAlchemy 1.4) still fetch the whole result into the driver,
+        # so here only the DataFrame construction is chunked, not the transfer
+        with self.engine.connect().execution_options(stream_results=True) as conn:
+            for df in pd.read_sql(statement, conn, chunksize=chunksize):
+                yield self.compact_frame(df, dates)
+
+    def read_frame(self, statement, dates = (), memory_budget = None, chunksize = FRAME_CHUNK_SIZE):
+        """
+        Fetch statement into one compact DataFrame, chunk by chunk. Raises MemoryError as soon as the frame would
+        exceed memory_budget bytes (default self.memory_budget); use iter_frames for pulls that do not fit.
+        """
+        budget = memory_budget or self.memory_budget
+        frames = []
+        used = 0
+        for df in self.iter_frames(statement, dates, chunksize):
+            used += df.memory_usage(deep=True).sum()
+            if budget and used > budget:
+                raise MemoryError('Result exceeds the memory budget of {0:.1f} MiB after {1} rows'.format(budget / 1024 / 1024, sum(len(f) for f in frames) + len(df)))
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=[c.name for c in statement.selected_columns])
+        df = pd.concat(frames, ignore_index=True)
+        if len(frames) > 1:
+            # chunks have their own categories, concat falls back to object for those columns
+            for col in FRAME_CATEGORICAL:
+                if col in df.columns:
+                    df[col] = union_categoricals([f[col] for f in frames])
+        return df
+
+    def present(self, frames, columns):
+        """
+        Presentation step: write a DataFrame, or an iterable of DataFrame chunks, through emit. columns is a list of
+        (title, column, format) where format is a format string, a callable or None for the value as is. Missing
+        values (None, NaN, NaT) are written as empty cells.
+        """
+        if isinstance(frames, pd.DataFrame):
+            frames = [frames]
+        formatters = [native if fmt is None else fmt.format if isinstance(fmt, str) else fmt for title, col, fmt in columns]
+        def rows():
+            for df in frames:
+                for values in zip(*(df[col] for title, col, fmt in columns)):
+                    yield ['' if pd.isna(v) else f(v) for f, v in zip(formatters, values)]
+        self.emit([title for title, col, fmt in columns], rows())
 
     """Helper methods"""
+    def emit(self, titles, rows):
+        if self.collected is not None:
+            self.collected.append((titles, list(rows)))
+            return
+        output_stream(titles, rows, self.output)
+
     def formatDate(self, d):
         return d.strftime("%d.%m.%Y %H:%M:%S")
 
@@ -81,234 +701,545 @@ class Manager:
     def formatNow(self):
         return datetime.now().strftime("%d.%m.%Y %H:%M")
 
+    def parseDate(self, d):
+        return d if isinstance(d, datetime) else datetime.strptime(d, "%Y-%m-%d")
+
+    def lnGrowthToPL(self, lngrowth):
+        return (math.exp(lngrowth or 0) - 1) * 100
+
+    def day_expr(self, col):
+        # truncate a datetime column to its day in the dialect of self.engine
+        if self.engine.dialect.name == 'sqlite':
+            return func.date(col)
+        return cast(col, Date)
+
     """Actual data query methods"""
     def get_users_follow_allowed(self):
         if self.dbsession is not None:
-            q = self.dbsession.query(self.tbl_user).\
-                order_by(self.tbl_user.Id).\
-                    filter(self.tbl_user.IsFollowingAllowed==True)
-            results = q.all()
-            print('{0} users are allowed to follow'.format(len(results)))
+            count = self.dbsession.query(func.count(self.tbl_user.Id)).\
+                filter(self.tbl_user.IsFollowingAllowed==True).scalar()
+            print('{0} users are allowed to follow'.format(count))
+
+    def followers_query(self, tradername):
+        trader_id = select(self.tbl_user.Id).where(self.tbl_user.UserName==tradername).scalar_subquery()
+        return select(self.tbl_user.UserName, self.tbl_follower.DateCreated.label('FollowingSince'), self.tbl_follower.FollowAmount).\
+            join_from(self.tbl_follower, self.tbl_user, self.tbl_follower.FollowedById==self.tbl_user.Id).\
+            where(self.tbl_follower.Deleted==False).\
+            where(self.tbl_follower.FollowedUserId==trader_id).\
+            order_by(self.tbl_follower.DateCreated.asc())
+
+    def followers_frame(self, tradername):
+        return self.read_frame(self.followers_query(tradername), dates=['FollowingSince'])
 
     def get_followers_of_trader(self, tradername):
         print('Followers of trader {0} ordered by follow date ascending:'.format(tradername))
-        titles = ["Trader", "Follower", "Following since"]
-        traders = []
-        followers = []
-        follow_dates = []
-        follow_amts = []
         if self.dbsession is not None:
-            trader_id = self.dbsession.query(self.tbl_user.Id).filter(self.tbl_user.UserName==tradername).first()
-            for followingSince, followerName, followAmount in self.dbsession.query(self.tbl_follower.DateCreated, self.tbl_user.UserName, self.tbl_follower.FollowAmount).\
-                join(self.tbl_user, self.tbl_follower.FollowedById==self.tbl_user.Id).\
-                order_by(self.tbl_follower.DateCreated.asc()).\
-                    filter(self.tbl_follower.Deleted==False).\
-                    filter(self.tbl_follower.FollowedUserId==trader_id):
-                traders.append(tradername)
-                followers.append(followerName)
-                follow_dates.append(self.formatDate(followingSince))
-                follow_amts.append('${:.2f}'.format(followAmount))
-                # print('{0} since {1}'.format(followerName, self.formatDate(followingSince)))
-            # output_table(titles, [traders, followers, follow_dates])
-            df = pd.DataFrame({'Trader': traders, 'Follower': followers, 'Following since': follow_dates, 'Follow Amount': follow_amts})
-            print(tabulate(df,headers='keys'))
+            frames = self.iter_frames(self.followers_query(tradername), dates=['FollowingSince'])
+            self.present((df.assign(Trader=tradername) for df in frames),
+                [('Trader', 'Trader', None), ('Follower', 'UserName', None), ('Following since', 'FollowingSince', self.formatDate), ('Follow Amount', 'FollowAmount', MONEY_FORMAT)])
+
+    """Profit/loss engine"""
+    def profitloss_query(self, usernames = None, start = None, end = None):
+        # DerivedPositionLnGrowth is a log return, so compounding is a plain SUM on the server
+        q = self.dbsession.query(self.tbl_user.UserName, func.sum(self.tbl_bmel.DerivedPositionLnGrowth).label('lngrowth')).\
+            join(self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id)
+        if usernames is not None:
+            q = q.filter(self.tbl_user.UserName.in_(usernames))
+        if start is not None:
+            q = q.filter(self.tbl_bmel.ExchangeTimeStamp >= self.parseDate(start))
+        if end is not None:
+            q = q.filter(self.tbl_bmel.ExchangeTimeStamp < self.parseDate(end))
+        return q.group_by(self.tbl_bmel.UserId, self.tbl_user.UserName)
+
+    def profitloss(self, usernames = None, start = None, end = None):
+        """
+        Compounded P/L in percent for the given users (all users if None), optionally windowed to [start, end).
+        Returns a dict username -> P/L, computed with a single grouped query.
+        """
+        return {uname: self.lnGrowthToPL(lngrowth) for uname, lngrowth in self.profitloss_query(usernames, start, end)}
+
+    def profitloss_frame(self, usernames = None, start = None, end = None):
+        """
+        profitloss() as a frame with UserName, lngrowth and PL (percent) columns.
+        """
+        return self.with_pl(self.read_frame(self.profitloss_query(usernames, start, end).statement))
+
+    def with_pl(self, df):
+        # vectorised lnGrowthToPL
+        df['PL'] = np.expm1(df['lngrowth'].fillna(0).to_numpy(dtype=float)) * 100
+        return df
+
+    def equity_curves(self, usernames = None, start = None, end = None):
+        """
+        Daily equity curves as growth multipliers. Returns (usernames, days, curves) where curves is a
+        len(usernames) x len(days) array; days without activity carry the previous value forward.
+        """
+        day = self.day_expr(self.tbl_bmel.ExchangeTimeStamp)
+        q = self.profitloss_query(usernames, start, end).\
+            add_columns(day.label('day')).\
+            group_by(day)
+        df = pd.read_sql(q.statement, self.engine)
+        users = pd.Categorical(df['UserName'])
+        days = pd.Categorical(pd.to_datetime(df['day']))
+        curves = np.zeros((len(users.categories), len(days.categories)))
+        np.add.at(curves, (users.codes, days.codes), df['lngrowth'].fillna(0).to_numpy(dtype=float))
+        return users.categories.to_numpy(), days.categories.to_numpy(), np.exp(np.cumsum(curves, axis=1))
 
     def get_profitloss_alltime(self, username):
         print('All-time profit-loss of user {0}:'.format(username))
-        users = []
-        pls = []
         if self.dbsession is not None:
-            user_id = self.dbsession.query(self.tbl_user.Id).filter(self.tbl_user.UserName==username).first()
-            users.append(username)
-            prevpl = 0
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            for plamount in self.dbsession.query(self.tbl_bmel.DerivedPositionLnGrowth).\
-                filter(self.tbl_bmel.UserId==user_id).all():
-                if prevpl == 0:
-                    prevpl = plamount
-                else:
-                    prevpl = self.addPL(prevpl, plamount)
-            pls.append('{:.2f}%'.format(prevpl))
-            df = pd.DataFrame({'User': users, 'P/L': pls})
-            print(tabulate(df,headers='keys'))
+            df = self.profitloss_frame([username])
+            self.present(pd.DataFrame({'UserName': [username], 'PL': [df['PL'].sum()]}), [('User', 'UserName', None), ('P/L', 'PL', PERCENT_FORMAT)])
 
-    def get_top_traders_volume(self, count):
-        print('Get top {0} traders by trading volume:'.format(count))
-        users = []
-        volumes = []
+    def top_traders_profitloss_frame(self, count, start = None, end = None):
+        lngrowth = func.sum(self.tbl_bmel.DerivedPositionLnGrowth)
+        q = self.profitloss_query(None, start, end).\
+            join(self.tbl_user_role, self.tbl_user.Id==self.tbl_user_role.UserId).\
+            filter(self.tbl_user_role.RoleId==ROLE_TRADER).\
+            order_by(lngrowth.desc()).\
+            limit(int(count))
+        return self.with_pl(self.read_frame(q.statement))
+
+    def get_top_traders_profitloss(self, count, start = None, end = None):
+        print('Get top {0} traders by compounded profit-loss:'.format(count))
+        if self.dbsession is not None:
+            self.present(self.top_traders_profitloss_frame(count, start, end), [('Trader', 'UserName', None), ('P/L', 'PL', PERCENT_FORMAT)])
+
+    def equity_summary_frame(self, usernames = None, start = None, end = None):
+        """
+        Per user: number of days, final P/L and maximum drawdown in percent of the daily equity curve.
+        """
+        users, days, curves = self.equity_curves(usernames, start, end)
+        drawdowns = 1 - curves / np.maximum.accumulate(curves, axis=1)
+        return pd.DataFrame({'UserName': pd.Categorical(users), 'Days': np.full(len(users), len(days), dtype=np.int32),
+            'PL': (curves[:, -1] - 1) * 100 if len(days) else np.zeros(len(users)), 'MaxDrawdown': drawdowns.max(axis=1, initial=0) * 100})
+
+    def get_equity_curves(self, username, start = None, end = None):
+        print('Daily equity curve of user {0}:'.format(username))
+        if self.dbsession is not None:
+            df = self.equity_summary_frame([username], start, end)
+            if df.empty:
+                print('No activity for user {0}'.format(username))
+                return
+            self.present(df, [('User', 'UserName', None), ('Days', 'Days', None), ('P/L', 'PL', PERCENT_FORMAT), ('Max Drawdown', 'MaxDrawdown', PERCENT_FORMAT)])
+
+    """Hourly profile engine"""
+    def hourly_profitloss(self, tradername, per_day = False):
+        """
+        Hourly sums of DerivedPositionLnGrowth for a trader and all of their active followers from one grouped query.
+        Returns (usernames, matrix) with the trader in the first row and matrix a users x 24 array, or with per_day
+        (usernames, days, matrix) with matrix a users x days x 24 array.
+        """
+        trader_id = select(self.tbl_user.Id).where(self.tbl_user.UserName==tradername).scalar_subquery()
+        follower_ids = select(self.tbl_follower.FollowedById).\
+            where(self.tbl_follower.FollowedUserId==trader_id).\
+            where(self.tbl_follower.Deleted==False)
+        hour = extract('hour', self.tbl_bmel.ExchangeTimeStamp)
+        columns = [self.tbl_user.UserName, hour.label('hour'), func.sum(self.tbl_bmel.DerivedPositionLnGrowth).label('plsum')]
+        group = [self.tbl_user.Id, self.tbl_user.UserName, hour]
+        if per_day:
+            day = self.day_expr(self.tbl_bmel.ExchangeTimeStamp)
+            columns.append(day.label('day'))
+            group.append(day)
+        q = select(*columns).\
+            join_from(self.tbl_bmel, self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id).\
+            where(or_(self.tbl_bmel.UserId==trader_id, self.tbl_bmel.UserId.in_(follower_ids))).\
+            group_by(*group)
+        df = pd.read_sql(q, self.engine)
+
+        usernames = np.array([tradername] + sorted(set(df['UserName']) - {tradername}))
+        users = pd.Categorical(df['UserName'], categories=usernames)
+        hours = df['hour'].to_numpy(dtype=int)
+        plsums = df['plsum'].fillna(0).to_numpy(dtype=float)
+        if per_day:
+            days = pd.Categorical(pd.to_datetime(df['day']))
+            matrix = np.zeros((len(usernames), len(days.categories), 24))
+            matrix[users.codes, days.codes, hours] = plsums
+            return usernames, days.categories.to_numpy(), matrix
+        matrix = np.zeros((len(usernames), 24))
+        matrix[users.codes, hours] = plsums
+        return usernames, matrix
+
+    def hourly_profitloss_frame(self, tradername):
+        """
+        hourly_profitloss() as a frame: UserName plus one column per hour 0..23, trader first.
+        """
+        usernames, matrix = self.hourly_profitloss(tradername)
+        df = pd.DataFrame(matrix, columns=list(range(24)))
+        df.insert(0, 'UserName', pd.Categorical(usernames))
+        return df
+
+    def get_hourly_profitloss(self, tradername):
+        print('Hourly profit-loss of trader {0} and followers:'.format(tradername))
+        if self.dbsession is not None:
+            self.present(self.hourly_profitloss_frame(tradername), [('User', 'UserName', None)] + [(hour, hour, LNGROWTH_FORMAT) for hour in range(24)])
+
+    """Copy-trading network"""
+    def follow_graph(self):
+        """
+        FollowGraph of all active Follower edges, loaded with two queries. At most every FOLLOW_GRAPH_CHECK_INTERVAL
+        seconds the User/Follower watermark is checked and the graph reloaded once it moved, so long-running
+        sessions do not serve the graph of their start while lookups in between stay in memory.
+        """
+        now = time.monotonic()
+        if self._follow_graph is not None and now - self._follow_graph_checked < FOLLOW_GRAPH_CHECK_INTERVAL:
+            return self._follow_graph
+        watermark = self.watermark(['User', 'Follower'])
+        self._follow_graph_checked = now
+        if self._follow_graph is None or self._follow_graph_watermark != watermark:
+            f = self.tbl_follower
+            active = f.Deleted==False
+            edges = pd.read_sql(select(f.FollowedUserId, f.FollowedById, f.FollowAmount).where(active), self.engine)
+            involved = select(f.FollowedUserId).where(active).union(select(f.FollowedById).where(active)).subquery()
+            users = pd.read_sql(select(self.tbl_user.Id, self.tbl_user.UserName).where(self.tbl_user.Id.in_(select(involved))), self.engine)
+            self._follow_graph = FollowGraph(edges['FollowedUserId'].to_numpy(), edges['FollowedById'].to_numpy(),
+                edges['FollowAmount'].fillna(0).to_numpy(dtype=float), users['Id'].to_numpy(), users['UserName'].to_numpy())
+            self._follow_graph_watermark = watermark
+        return self._follow_graph
+
+    def network_frame(self, graph = None):
+        """
+        Follower count, AUM and concentration of every trader with at least one active follower.
+        """
+        graph = graph or self.follow_graph()
+        counts = graph.follower_counts()
+        traders = np.flatnonzero(counts)
+        return pd.DataFrame({'UserName': pd.Categorical(graph.usernames[traders]), 'Followers': counts[traders].astype(np.int32),
+            'AUM': graph.aum()[traders], 'Concentration': graph.concentration()[traders]})
+
+    def get_network_stats(self, count = 10):
+        print('Get top {0} traders by follower AUM:'.format(count))
+        if self.dbsession is not None:
+            graph = self.follow_graph()
+            df = self.network_frame(graph)
+            self.present(df.sort_values('AUM', ascending=False, kind='stable').head(int(count)),
+                [('Trader', 'UserName', None), ('Followers', 'Followers', None), ('AUM', 'AUM', MONEY_FORMAT), ('Concentration', 'Concentration', RATIO_FORMAT)])
+            print('{0} traders with followers, {1} active follows, {2} AUM in total'.format(len(df), len(graph.indices), MONEY_FORMAT.format(df['AUM'].sum())))
+            print('{0} followers copy more than one trader'.format(np.count_nonzero(graph.traders_copied() > 1)))
+
+    def network_followers_frame(self, tradername):
+        followers, amounts = self.follow_graph().followers_of(tradername)
+        return pd.DataFrame({'Trader': pd.Categorical([tradername] * len(followers)), 'UserName': pd.Categorical(followers), 'FollowAmount': amounts})
+
+    def get_network_followers(self, tradername):
+        print('Followers of trader {0} from the copy-trading network:'.format(tradername))
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            for tvol, uname in self.dbsession.query(func.sum(self.tbl_bmel.DerivedTradeVolume).label('tradevol'), self.tbl_user.UserName).\
+            self.present(self.network_followers_frame(tradername),
+                [('Trader', 'Trader', None), ('Follower', 'UserName', None), ('Follow Amount', 'FollowAmount', MONEY_FORMAT)])
+
+    """Leaderboard engine"""
+    def leaderboard(self, role_id, metric, aggregation, count, with_volume = False):
+        """
+        Top `count` users of a role by `aggregation` ('sum', 'max' or 'latest') of a BinanceMirrorEventLogs column.
+        The limit is applied on the server (TOP n / LIMIT n); 'latest' ranks rows per user with ROW_NUMBER()
+        and joins the per-user SUM(DerivedTradeVolume) when with_volume is set.
+        Returns a query yielding (value, username) or (value, tradevol, username) when with_volume is set.
+        """
+        metric_col = getattr(self.tbl_bmel, metric)
+        if aggregation == 'latest':
+            ranked = self.dbsession.query(self.tbl_bmel.UserId.label('UserId'), metric_col.label('value'),
+                func.row_number().over(partition_by=self.tbl_bmel.UserId, order_by=self.tbl_bmel.ExchangeTimeStamp.desc()).label('rn')).\
+                join(self.tbl_user_role, self.tbl_bmel.UserId==self.tbl_user_role.UserId).\
+                filter(self.tbl_user_role.RoleId==role_id).subquery()
+            columns = [ranked.c.value]
+            if with_volume:
+                volume = self.dbsession.query(self.tbl_bmel.UserId.label('UserId'), func.sum(self.tbl_bmel.DerivedTradeVolume).label('tradevol')).\
+                    join(self.tbl_user_role, self.tbl_bmel.UserId==self.tbl_user_role.UserId).\
+                    filter(self.tbl_user_role.RoleId==role_id).\
+                    group_by(self.tbl_bmel.UserId).subquery()
+                columns.append(volume.c.tradevol)
+            q = self.dbsession.query(*columns, self.tbl_user.UserName).\
+                join(self.tbl_user, ranked.c.UserId==self.tbl_user.Id)
+            if with_volume:
+                q = q.join(volume, volume.c.UserId==ranked.c.UserId)
+            q = q.filter(ranked.c.rn==1).\
+                order_by(ranked.c.value.desc())
+        elif aggregation in ('sum', 'max'):
+            value = getattr(func, aggregation)(metric_col)
+            columns = [value.label('value')]
+            if with_volume:
+                columns.append(func.sum(self.tbl_bmel.DerivedTradeVolume).label('tradevol'))
+            q = self.dbsession.query(*columns, self.tbl_user.UserName).\
                 join(self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id).\
                 join(self.tbl_user_role, self.tbl_user.Id==self.tbl_user_role.UserId).\
-                filter(self.tbl_user_role.RoleId==3).\
+                filter(self.tbl_user_role.RoleId==role_id).\
                 group_by(self.tbl_user.UserName).\
-                order_by(func.sum(self.tbl_bmel.DerivedTradeVolume).desc()).all()[0:int(count)]:
-                users.append(uname)
-                volumes.append('${:.2f}'.format(tvol))
+                order_by(value.desc())
+        else:
+            raise ValueError('Unknown aggregation "{0}"'.format(aggregation))
+        return q.limit(int(count))
 
-            df = pd.DataFrame({'Trader': users, 'Trading Volume': volumes})
-            print(tabulate(df,headers='keys'))
+    def leaderboard_frame(self, role_id, metric, aggregation, count, with_volume = False):
+        return self.read_frame(self.leaderboard(role_id, metric, aggregation, count, with_volume).statement)
+
+    def get_top_traders_volume(self, count):
+        print('Get top {0} traders by trading volume:'.format(count))
+        if self.dbsession is not None:
+            self.present(self.leaderboard_frame(ROLE_TRADER, 'DerivedTradeVolume', 'sum', count),
+                [('Trader', 'UserName', None), ('Trading Volume', 'value', MONEY_FORMAT)])
 
     def get_top_followers_volume(self, count):
         print('Get top {0} followers by trading volume:'.format(count))
-        users = []
-        volumes = []
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            for tvol, uname in self.dbsession.query(func.sum(self.tbl_bmel.DerivedTradeVolume).label('tradevol'), self.tbl_user.UserName).\
-                join(self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id).\
-                join(self.tbl_user_role, self.tbl_user.Id==self.tbl_user_role.UserId).\
-                filter(self.tbl_user_role.RoleId==4).\
-                group_by(self.tbl_user.UserName).\
-                order_by(func.sum(self.tbl_bmel.DerivedTradeVolume).desc()).all()[0:int(count)]:
-                users.append(uname)
-                volumes.append('${:.2f}'.format(tvol))
-
-            df = pd.DataFrame({'Follower': users, 'Trading Volume': volumes})
-            print(tabulate(df,headers='keys'))
+            self.present(self.leaderboard_frame(ROLE_FOLLOWER, 'DerivedTradeVolume', 'sum', count),
+                [('Follower', 'UserName', None), ('Trading Volume', 'value', MONEY_FORMAT)])
 
     def get_top_traders_balance(self, count):
         print('Get top {0} traders by latest portfolio balance:'.format(count))
-        users = []
-        volumes = []
-        balances = []
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            for usdtbalance, tradevol, uname in self.dbsession.query(func.max(self.tbl_bmel.DerivedUsdtValue).label('balance'), func.sum(self.tbl_bmel.DerivedTradeVolume).label('tradevol'), self.tbl_user.UserName).\
-                join(self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id).\
-                join(self.tbl_user_role, self.tbl_user.Id==self.tbl_user_role.UserId).\
-                filter(self.tbl_user_role.RoleId==3).\
-                group_by(self.tbl_user.UserName).\
-                order_by(func.max(self.tbl_bmel.DerivedUsdtValue).desc()).all()[0:int(count)]:
-                users.append(uname)
-                volumes.append('${:.2f}'.format(tradevol))
-                balances.append('${:.2f}'.format(usdtbalance))
-
-            df = pd.DataFrame({'Trader': users, 'Total Balance': balances, 'Trading Volume': volumes})
-            print(tabulate(df,headers='keys'))
+            self.present(self.leaderboard_frame(ROLE_TRADER, 'DerivedUsdtValue', 'latest', count, with_volume=True),
+                [('Trader', 'UserName', None), ('Total Balance', 'value', MONEY_FORMAT), ('Trading Volume', 'tradevol', MONEY_FORMAT)])
 
     def get_top_followers_balance_max(self, count):
         print('Get top {0} followers by max portfolio balance:'.format(count))
-        users = []
-        volumes = []
-        balances = []
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            for usdtbalance, tradevol, uname in self.dbsession.query(func.max(self.tbl_bmel.DerivedUsdtValue).label('balance'), func.sum(self.tbl_bmel.DerivedTradeVolume).label('tradevol'), self.tbl_user.UserName).\
-                join(self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id).\
-                join(self.tbl_user_role, self.tbl_user.Id==self.tbl_user_role.UserId).\
-                filter(self.tbl_user_role.RoleId==4).\
-                group_by(self.tbl_user.UserName).\
-                order_by(func.max(self.tbl_bmel.DerivedUsdtValue).desc()).all()[0:int(count)]:
-                users.append(uname)
-                volumes.append('${:.2f}'.format(tradevol))
-                balances.append('${:.2f}'.format(usdtbalance))
-
-            df = pd.DataFrame({'Follower': users, 'Total Balance': balances, 'Trading Volume': volumes})
-            print(tabulate(df,headers='keys'))
+            self.present(self.leaderboard_frame(ROLE_FOLLOWER, 'DerivedUsdtValue', 'max', count, with_volume=True),
+                [('Follower', 'UserName', None), ('Total Balance', 'value', MONEY_FORMAT), ('Trading Volume', 'tradevol', MONEY_FORMAT)])
 
     def get_top_followers_balance(self, count):
         print('Get top {0} followers by latest portfolio balance:'.format(count))
-        users = []
-        balances = []
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            for usdtbalance, uname in self.dbsession.query(self.tbl_bmel.DerivedUsdtValue, self.tbl_user.UserName).\
-                join(self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id).\
-                join(self.tbl_user_role, self.tbl_user.Id==self.tbl_user_role.UserId).\
-                filter(self.tbl_user_role.RoleId==4).\
-                group_by(self.tbl_user.UserName).\
-                order_by(self.tbl_bmel.DateCreated.desc()).all()[0:int(count)]:
-                users.append(uname)
-                balances.append('${:.2f}'.format(usdtbalance))
+            self.present(self.leaderboard_frame(ROLE_FOLLOWER, 'DerivedUsdtValue', 'latest', count),
+                [('Follower', 'UserName', None), ('Latest Balance', 'value', MONEY_FORMAT)])
+
+    """Status engine"""
+    def wallet_detail(self):
+        """
+        Transaction totals per (UserId, TransactionType, WalletType); the single GROUP BY every wallet figure is derived from.
+        """
+        t, w = self.tbl_transaction, self.tbl_wallet
+        return select(w.UserId.label('UserId'), t.TransactionType.label('TransactionType'), t.WalletType.label('WalletType'),
+            func.sum(t.Amount).label('Amount'),
+            func.sum(func.abs(t.Amount)).label('AbsAmount'),
+            func.sum(case((t.Amount > 0, t.Amount), else_=0)).label('Deposits'),
+            func.sum(case((t.Amount < 0, 1), else_=0)).label('NegativeCount')).\
+            join_from(t, w, w.Id == t.WalletId).\
+            group_by(w.UserId, t.TransactionType, t.WalletType)
+
+    def wallet_aggregate(self):
+        """
+        Per-user wallet figures as a CTE for server-side use: Balance, UnlockedBalance, WithdrawalCount,
+        WithdrawnAmount, CreditedAmount (types other than withdrawal and 2) and DepositAmount.
+        """
+        if self._wallet_aggregate is None:
+            d = self.wallet_detail().cte('wallet_detail')
+            self._wallet_aggregate = select(d.c.UserId,
+                func.sum(d.c.Amount).label('Balance'),
+                func.sum(case((d.c.WalletType.in_(UNLOCKED_WALLET_TYPES), d.c.Amount), else_=0)).label('UnlockedBalance'),
+                func.sum(case((d.c.TransactionType == 1, d.c.NegativeCount), else_=0)).label('WithdrawalCount'),
+                func.sum(case((d.c.TransactionType == 1, d.c.AbsAmount))).label('WithdrawnAmount'),
+                func.sum(case((d.c.TransactionType.notin_([1, 2]), d.c.AbsAmount))).label('CreditedAmount'),
+                func.sum(d.c.Deposits).label('DepositAmount')).\
+                group_by(d.c.UserId).cte('wallet_aggregate')
+        return self._wallet_aggregate
+
+    def wallet_table(self):
+        """
+        In-process per-user wallet table indexed by UserId, fetched once and kept for the lifetime of the Manager.
+        Has the wallet_aggregate columns plus Deposits_T<TransactionType> and Balance_W<WalletType>.
+        """
+        if self._wallet_table is None:
+            detail = pd.read_sql(self.wallet_detail(), self.engine)
+            by_user = detail.groupby('UserId')
+            withdrawal = detail['TransactionType'] == 1
+            credited = detail['TransactionType'].notna() & ~detail['TransactionType'].isin([1, 2])
+            table = pd.DataFrame({
+                'Balance': by_user['Amount'].sum(),
+                'UnlockedBalance': detail['Amount'].where(detail['WalletType'].isin(UNLOCKED_WALLET_TYPES), 0).groupby(detail['UserId']).sum(),
+                'WithdrawalCount': detail['NegativeCount'].where(withdrawal, 0).groupby(detail['UserId']).sum(),
+                'WithdrawnAmount': detail['AbsAmount'].where(withdrawal).groupby(detail['UserId']).sum(min_count=1),
+                'CreditedAmount': detail['AbsAmount'].where(credited).groupby(detail['UserId']).sum(min_count=1),
+                'DepositAmount': by_user['Deposits'].sum(),
+            })
+            deposits = detail.pivot_table(index='UserId', columns='TransactionType', values='Deposits', aggfunc='sum', fill_value=0)
+            balances = detail.pivot_table(index='UserId', columns='WalletType', values='Amount', aggfunc='sum', fill_value=0)
+            self._wallet_table = table.join(deposits.add_prefix('Deposits_T')).join(balances.add_prefix('Balance_W'))
+        return self._wallet_table
+
+    def user_wallets(self, user_ids):
+        """
+        (Balance, UnlockedBalance) per user id, from the in-process wallet table if enabled, else from the CTE.
+        """
+        if self.wallet_cache:
+            table = self.wallet_table()
+            found = table.loc[table.index.intersection(user_ids), ['Balance', 'UnlockedBalance']]
+            return {user_id: (balance, unlocked) for user_id, balance, unlocked in found.itertuples()}
+        agg = self.wallet_aggregate()
+        q = self.dbsession.query(agg.c.UserId, agg.c.Balance, agg.c.UnlockedBalance).\
+            filter(agg.c.UserId.in_(user_ids))
+        return {user_id: (balance, unlocked) for user_id, balance, unlocked in q}
+
+    def kpi_cnt_users(self, session):
+        return session.query(func.count(self.tbl_user.Id)).\
+            filter(self.tbl_user.Deleted==0).\
+            filter(self.tbl_user.EmailConfirmed==1).scalar()
 
-            df = pd.DataFrame({'Follower': users, 'Latest Balance': balances})
-            print(tabulate(df,headers='keys'))
+    def kpi_cnt_users_basisid_kyc(self, session):
+        return session.query(func.count(self.tbl_user.Id)).\
+            filter(self.tbl_user.IsBasisKycDone==1).scalar()
+
+    def kpi_cnt_users_basisid_kyc_with_balance(self, session):
+        agg = self.wallet_aggregate()
+        return session.query(func.count(self.tbl_user.Id)).\
+            join(agg, agg.c.UserId==self.tbl_user.Id).\
+            filter(self.tbl_user.IsBasisKycDone==1).\
+            filter(agg.c.Balance > 0).scalar()
+
+    def kpi_cnt_user_with_withdrawals(self, session):
+        agg = self.wallet_aggregate()
+        return session.query(func.count(self.tbl_user.Id)).\
+            join(agg, agg.c.UserId==self.tbl_user.Id).\
+            filter(agg.c.WithdrawalCount > 0).scalar()
+
+    def kpi_cnt_users_basisid_kyc_withdrawn_all(self, session):
+        agg = self.wallet_aggregate()
+        return session.query(func.count(self.tbl_user.Id)).\
+            join(agg, agg.c.UserId==self.tbl_user.Id).\
+            filter(self.tbl_user.IsBasisKycDone==1).\
+            filter(agg.c.WithdrawnAmount==agg.c.CreditedAmount).scalar()
+
+    def sum_unlocked_query(self):
+        # straight from Transaction: rows without a Wallet or User still count, like every other unlocked amount
+        # need to customize to respect vesting rules for other wallet types later
+        return select(func.sum(self.tbl_transaction.Amount)).\
+            where(self.tbl_transaction.WalletType.in_(UNLOCKED_WALLET_TYPES))
+
+    def kpi_sum_unlocked_tyc_wallets(self, session):
+        return session.execute(self.sum_unlocked_query()).scalar()
+
+    def slt_status_values(self, session):
+        """
+        All SLT_STATUS_KPIS in one round trip: conditional aggregation over User left joined to the wallet aggregate,
+        the unlocked sum as a scalar subquery over Transaction.
+        """
+        u = self.tbl_user
+        agg = self.wallet_aggregate()
+        kyc = u.IsBasisKycDone==1
+        row = session.query(
+            func.sum(case((and_(u.Deleted==0, u.EmailConfirmed==1), 1), else_=0)).label('cnt_users'),
+            func.sum(case((kyc, 1), else_=0)).label('cnt_users_basisid_kyc'),
+            func.sum(case((and_(kyc, agg.c.Balance > 0), 1), else_=0)).label('cnt_users_basisid_kyc_with_balance'),
+            func.sum(case((agg.c.WithdrawalCount > 0, 1), else_=0)).label('cnt_user_with_withdrawals'),
+            func.sum(case((and_(kyc, agg.c.WithdrawnAmount==agg.c.CreditedAmount), 1), else_=0)).label('cnt_users_basisid_kyc_withdrawn_all'),
+            self.sum_unlocked_query().scalar_subquery().label('sum_unlocked_tyc_wallets')).\
+            select_from(u).\
+            outerjoin(agg, agg.c.UserId==u.Id).one()
+        values = dict(row._mapping)
+        # SUM over an empty User table is NULL where COUNT was 0
+        for key, fmt in SLT_STATUS_KPIS:
+            if key.startswith('cnt_') and values[key] is None:
+                values[key] = 0
+        return values
+
+    def slt_status_values_parallel(self):
+        # every KPI runs on its own pooled connection, so wall time is that of the slowest one
+        def run(key):
+            with self.Session() as session:
+                return getattr(self, 'kpi_' + key)(session)
+        with ThreadPoolExecutor(max_workers=len(SLT_STATUS_KPIS)) as executor:
+            futures = {key: executor.submit(run, key) for key, fmt in SLT_STATUS_KPIS}
+            return {key: future.result() for key, future in futures.items()}
+
+    def print_kpi(self, key, value):
+        print(dict(SLT_STATUS_KPIS)[key].format(value, self.formatNow()))
 
     def get_cnt_user_with_withdrawals(self, suppress_action = False):
         if suppress_action == False:
             print('Get number of users that had at least one withdrawal already:')
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            num_of_users, = self.dbsession.query(func.count(self.tbl_user.Id)).\
-                filter(
-                    text("exists (select t2.Id from [Transaction] t2 join Wallet w2 on w2.Id = t2.WalletId where w2.UserId = [User].[Id] and t2.Amount < 0 and t2.TransactionType = 1)")
-                ).first()
-
-            print("{0} users already had at least one withdrawal as of {1}".format(num_of_users, self.formatNow()))
+            self.print_kpi('cnt_user_with_withdrawals', self.kpi_cnt_user_with_withdrawals(self.dbsession))
 
     def get_cnt_users_basisid_kyc(self, suppress_action = False):
         if suppress_action == False:
             print('Get number of users that completed BasisId KYC successfully:')
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            num_of_users, = self.dbsession.query(func.count(self.tbl_user.Id)).\
-                filter(self.tbl_user.IsBasisKycDone==1).first()
-
-            print("{0} users completed BasisId KYC successfully as of {1}".format(num_of_users, self.formatNow()))
+            self.print_kpi('cnt_users_basisid_kyc', self.kpi_cnt_users_basisid_kyc(self.dbsession))
 
     def get_cnt_users_basisid_kyc_with_balance(self, suppress_action = False):
         if suppress_action == False:
             print('Get number of users that completed BasisId KYC successfully with balance > 0 TYC:')
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            num_of_users, = self.dbsession.query(func.count(self.tbl_user.Id)).\
-                filter(self.tbl_user.IsBasisKycDone==1).\
-                filter(text("(select sum(t2.Amount) from [Transaction] t2 join Wallet w2 on w2.Id = t2.WalletId where w2.UserId = [User].[Id]) > 0")).first()
-
-            print("{0} users with TYC balance > 0 completed BasisId KYC successfully as of {1}".format(num_of_users, self.formatNow()))
+            self.print_kpi('cnt_users_basisid_kyc_with_balance', self.kpi_cnt_users_basisid_kyc_with_balance(self.dbsession))
 
     def get_cnt_users_basisid_kyc_withdrawn_all(self, suppress_action = False):
         if suppress_action == False:
             print('Get number of users that completed BasisId KYC successfully and withdrew all their token:')
         if self.dbsession is not None:
-            # for plamount, in self.dbsession.query(func.sum(self.tbl_bmel.DerivedPositionLnGrowth)).\
-            num_of_users, = self.dbsession.query(func.count(self.tbl_user.Id)).\
-                filter(self.tbl_user.IsBasisKycDone==1).\
-                filter(text("(select sum(abs(t2.Amount)) from [Transaction] t2 join Wallet w2 on w2.Id = t2.WalletId where w2.UserId = [User].[Id] and t2.TransactionType = 1) = (select sum(abs(t2.Amount)) from [Transaction] t2 join Wallet w2 on w2.Id = t2.WalletId where w2.UserId = [User].[Id] and t2.TransactionType <> 1 and t2.TransactionType <> 2)")).first()
-
-            print("{0} users completed BasisId KYC successfully and withdrew everything as of {1}".format(num_of_users, self.formatNow()))
+            self.print_kpi('cnt_users_basisid_kyc_withdrawn_all', self.kpi_cnt_users_basisid_kyc_withdrawn_all(self.dbsession))
 
     def get_sum_unlocked_tyc_wallets(self, suppress_action = False):
         if suppress_action == False:
             print('Get sum of all unlocked TYC currently in wallets:')
         if self.dbsession is not None:
-            # need to customize to respect vesting rules for other wallet types later
-            num_of_users, = self.dbsession.query(func.sum(self.tbl_transaction.Amount)).\
-                filter(or_(self.tbl_transaction.WalletType==1, self.tbl_transaction.WalletType==0)).first()
-
-            print("{0} TYC in total are unlocked available in wallets as of {1} (query to be refined)".format(num_of_users, self.formatNow()))
+            self.print_kpi('sum_unlocked_tyc_wallets', self.kpi_sum_unlocked_tyc_wallets(self.dbsession))
 
     def get_cnt_users(self, suppress_action = False):
         if suppress_action == False:
             print('Get count of all verified users:')
         if self.dbsession is not None:
-            # need to customize to respect vesting rules for other wallet types later
-            num_of_users, = self.dbsession.query(func.count(self.tbl_user.Id)).\
-                filter(self.tbl_user.Deleted==0).\
-                filter(self.tbl_user.EmailConfirmed==1).first()
+            self.print_kpi('cnt_users', self.kpi_cnt_users(self.dbsession))
+
+    def event_history_query(self, usernames = None, start = None, end = None):
+        q = select(self.tbl_user.UserName, self.tbl_bmel.ExchangeTimeStamp, self.tbl_bmel.DerivedUsdtValue,
+            self.tbl_bmel.DerivedTradeVolume, self.tbl_bmel.DerivedPositionLnGrowth).\
+            join_from(self.tbl_bmel, self.tbl_user, self.tbl_bmel.UserId==self.tbl_user.Id)
+        if usernames is not None:
+            q = q.where(self.tbl_user.UserName.in_(usernames))
+        if start is not None:
+            q = q.where(self.tbl_bmel.ExchangeTimeStamp >= self.parseDate(start))
+        if end is not None:
+            q = q.where(self.tbl_bmel.ExchangeTimeStamp < self.parseDate(end))
+        return q.order_by(self.tbl_bmel.UserId, self.tbl_bmel.ExchangeTimeStamp)
 
-            print("{0} verified users as of {1}".format(num_of_users, self.formatNow()))
+    def event_history_frame(self, usernames = None, start = None, end = None, memory_budget = None):
+        return self.read_frame(self.event_history_query(usernames, start, end), dates=['ExchangeTimeStamp'], memory_budget=memory_budget)
+
+    def last_activity_frame(self, username):
+        q = self.event_history_query([username]).\
+            order_by(None).\
+            order_by(self.tbl_bmel.ExchangeTimeStamp.desc()).\
+            limit(1)
+        return self.read_frame(q, dates=['ExchangeTimeStamp'])
+
+    def get_event_history(self, username, start = None, end = None):
+        print('Event log history of user {0}:'.format(username))
+        if self.dbsession is not None:
+            self.present(self.iter_frames(self.event_history_query([username], start, end), dates=['ExchangeTimeStamp']),
+                [('Activity Date', 'ExchangeTimeStamp', self.formatDate), ('Portfolio USDT', 'DerivedUsdtValue', MONEY_FORMAT),
+                ('Trading Volume', 'DerivedTradeVolume', MONEY_FORMAT), ('PositionLnGrowth', 'DerivedPositionLnGrowth', None)])
 
     def get_last_activity(self, username, suppress_action = False):
         if suppress_action == False:
             print('Get last activity of user {0}'.format(username))
         if self.dbsession is not None:
-            user_id = self.dbsession.query(self.tbl_user.Id).filter(self.tbl_user.UserName==username).first()
-            for exchangetimestamp, usdtval, growth in self.dbsession.query(self.tbl_bmel.ExchangeTimeStamp, self.tbl_bmel.DerivedUsdtValue, self.tbl_bmel.DerivedPositionLnGrowth).\
-                filter(self.tbl_bmel.UserId==user_id).\
-                order_by(self.tbl_bmel.ExchangeTimeStamp.desc()).all()[0:1]:
-                print('Activity Date: {0} Portfolio USDT: ${1:.2f} PositionLnGrowth: {2}%'.format(self.formatDate(exchangetimestamp), usdtval, growth))
+            self.present(self.last_activity_frame(username),
+                [('Activity Date', 'ExchangeTimeStamp', self.formatDate), ('Portfolio USDT', 'DerivedUsdtValue', MONEY_FORMAT), ('PositionLnGrowth', 'DerivedPositionLnGrowth', RAW_PERCENT_FORMAT)])
+
+
+    def slt_status(self, mode = 'single'):
+        """
+        mode 'single' computes every KPI in one query, 'parallel' runs the KPI queries concurrently
+        and 'sequential' runs them one after another on the session.
+        """
+        if mode == 'single':
+            return self.slt_status_values(self.dbsession)
+        elif mode == 'parallel':
+            return self.slt_status_values_parallel()
+        elif mode == 'sequential':
+            return {key: getattr(self, 'kpi_' + key)(self.dbsession) for key, fmt in SLT_STATUS_KPIS}
+        raise ValueError('Unknown mode "{0}"'.format(mode))
 
+    def slt_status_frame(self, mode = 'single'):
+        values = self.slt_status(mode)
+        df = pd.DataFrame({key: [values[key]] for key, fmt in SLT_STATUS_KPIS})
+        df['sum_unlocked_tyc_wallets'] = df['sum_unlocked_tyc_wallets'].astype(float)
+        df.insert(0, 'as_of', pd.Timestamp.now())
+        return self.compact_frame(df)
 
-    def get_slt_general_status(self):
-        self.get_cnt_users(True)
-        self.get_cnt_users_basisid_kyc(True)
-        self.get_cnt_users_basisid_kyc_with_balance(True)
-        self.get_cnt_user_with_withdrawals(True)
-        self.get_cnt_users_basisid_kyc_withdrawn_all(True)
-        self.get_sum_unlocked_tyc_wallets(True)
+    def get_slt_general_status(self, mode = 'single'):
+        values = self.slt_status(mode)
+        for key, fmt in SLT_STATUS_KPIS:
+            self.print_kpi(key, values[key])
 
     def supp_check(self, email):
         print('General checkup of email {0}:'.format(email))
@@ -350,43 +1281,193 @@ class Manager:
             print('KYC Attempts in total: {0}'.format(kyc_attempts_cnt))
             print('Is allowed to follow: {0}'.format('yes' if userobj.IsFollowingAllowed else 'no'))
             # token balance
+            balance, unlocked = self.user_wallets([userobj.Id]).get(userobj.Id, (0, 0))
+            print('Token balance: {0} TYC ({1} TYC unlocked)'.format(balance, unlocked))
+
+    def supp_check_bulk(self, path = '-'):
+        """
+        supp_check for every email in a file (one per line, '-' for stdin), one output row per email.
+        Each chunk of IN_CHUNK_SIZE emails costs four queries: users, roles, KYC attempts and wallets. Rows are
+        written as soon as their chunk is resolved.
+        """
+        if path == '-' and self.command_source is sys.stdin:
+            raise ValueError('stdin holds the session commands, pass a file of emails instead of "-"')
+        # stdin stays open for whoever reads it next
+        with (nullcontext(sys.stdin) if path == '-' else open(path)) as f:
+            emails = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        self.present(self.supp_check_frames(emails),
+            [('Email', 'Email', None), ('User', 'UserName', None), ('Email verified', 'EmailConfirmed', format_yesno), ('Role', 'Role', None),
+            ('Old KYC', 'IsKycDone', format_yesno), ('BasisId KYC', 'IsBasisKycDone', format_yesno), ('KYC issue', 'KycIssue', format_yesno),
+            ('KYC attempts', 'KycAttempts', None), ('Follow allowed', 'IsFollowingAllowed', format_yesno),
+            ('Token balance', 'Balance', None), ('Unlocked balance', 'UnlockedBalance', None)])
+
+    def supp_check_frames(self, emails):
+        """
+        supp_check figures as one DataFrame per chunk of emails, in input order; emails without a user
+        only have the Email column set.
+        """
+        for chunk in chunked(emails, IN_CHUNK_SIZE):
+            # emails are matched case-insensitively like the database collation does
+            users = {u.Email.lower(): u for u in self.dbsession.query(self.tbl_user.Id, self.tbl_user.Email, self.tbl_user.UserName,
+                self.tbl_user.EmailConfirmed, self.tbl_user.IsKycDone, self.tbl_user.IsBasisKycDone, self.tbl_user.IsFollowingAllowed).\
+                filter(self.tbl_user.Email.in_(chunk))}
+            user_ids = [u.Id for u in users.values()]
+            roles = {}
+            kyc = {}
+            wallets = {}
+            if user_ids:
+                for user_id, role_id in self.dbsession.query(self.tbl_user_role.UserId, self.tbl_user_role.RoleId).\
+                    filter(self.tbl_user_role.UserId.in_(user_ids)):
+                    roles.setdefault(user_id, set()).add(role_id)
+                for user_id, attempts, status10 in self.dbsession.query(self.tbl_kyc_attempts.UserId, func.count(self.tbl_kyc_attempts.Id),
+                    func.sum(case((self.tbl_kyc_attempts.BasisIdStatus == 10, 1), else_=0))).\
+                    filter(self.tbl_kyc_attempts.UserId.in_(user_ids)).\
+                    group_by(self.tbl_kyc_attempts.UserId):
+                    kyc[user_id] = (attempts, status10)
+                wallets = self.user_wallets(user_ids)
 
+            rows = []
+            for email in chunk:
+                u = users.get(email.lower())
+                if u is None:
+                    rows.append({'Email': email})
+                    continue
+                attempts, status10 = kyc.get(u.Id, (0, 0))
+                balance, unlocked = wallets.get(u.Id, (0, 0))
+                rows.append({'Email': email, 'UserName': u.UserName, 'EmailConfirmed': bool(u.EmailConfirmed),
+                    'Role': 'Trader' if ROLE_TRADER in roles.get(u.Id, ()) else 'Follower',
+                    'IsKycDone': bool(u.IsKycDone), 'IsBasisKycDone': bool(u.IsBasisKycDone),
+                    'KycIssue': not u.IsBasisKycDone and status10 >= 1,
+                    'KycAttempts': attempts, 'IsFollowingAllowed': bool(u.IsFollowingAllowed), 'Balance': balance, 'UnlockedBalance': unlocked})
+            yield pd.DataFrame(rows, columns=['Email', 'UserName', 'EmailConfirmed', 'Role', 'IsKycDone', 'IsBasisKycDone', 'KycIssue',
+                'KycAttempts', 'IsFollowingAllowed', 'Balance', 'UnlockedBalance']).astype({'KycAttempts': 'Int64'})
 
-"""
-timeaxis = [*range(24)]
-chartdata_trader = []
-chartdata_followers = []
-with engine.connect() as conn:
-  t_user = conn.execute(text("select UserName from [User] where Id = {0}".format(trader_id)))
-  trader = t_user.one()
-  trader_result = conn.execute(text("select DATEPART(HOUR,ExchangeTimeStamp), sum(DerivedPositionLnGrowth) as 'plsum' from BinanceMirrorEventLogs where UserId = {0} group by DATEPART(HOUR,ExchangeTimeStamp) order by DATEPART(HOUR,ExchangeTimeStamp)".format(trader_id)))
-  t_arr = []
-  for t_row in trader_result:
-    t_arr.append(t_row.plsum)
-  chartdata_trader.append([trader.UserName, t_arr])
-  result = conn.execute(text("select f.FollowedById, f.FollowedUserId, f.DateCreated, f.FollowAmount, u.UserName from Follower f join [User] u on u.Id = f.FollowedById where f.FollowedUserId = {0} and f.Deleted = 0".format(trader_id)))
-  frows = result.all()
-  for row in frows:
-    print('Follower: {0}'.format(row.UserName))
-    f_res = conn.execute(text("select DATEPART(HOUR,ExchangeTimeStamp), sum(DerivedPositionLnGrowth) as 'plsum' from BinanceMirrorEventLogs where UserId = {0} group by DATEPART(HOUR,ExchangeTimeStamp) order by DATEPART(HOUR,ExchangeTimeStamp)".format(row.FollowedById)))
-    f_arr = []
-    for f_resd in f_res:
-      f_arr.append(f_resd.plsum)
-    chartdata_followers.append([row.UserName, f_arr])
-  # print(result.all())
-  """
+
+def dispatch(m, methodname, userargs = None):
+    # every public Manager method is a command
+    if methodname.startswith('_') or not callable(getattr(m, methodname, None)):
+        raise ValueError('Unknown method "{0}"'.format(methodname))
+    if m.profiler is not None:
+        m.profiler.method = methodname
+    # several parameters are passed comma separated, e.g. -p Moneyguru,2023-01-01,2023-02-01
+    args = userargs.split(',') if userargs else []
+    method = getattr(m, methodname)
+    if m.result_cache is not None and methodname in CACHED_METHODS:
+        m.result_cache.run(m, methodname, args, lambda: method(*args))
+    else:
+        method(*args)
+
+def run_session(m, lines):
+    """
+    Run `method parameters` lines (e.g. "get_top_traders_volume 10") one after another on the same Manager.
+    Empty lines and lines starting with # are skipped; a failing command does not end the session.
+    """
+    timings = []
+    m.command_source = lines
+    try:
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            methodname, _, userargs = line.partition(' ')
+            started_at = time.monotonic()
+            try:
+                dispatch(m, methodname, userargs.strip())
+            except Exception as e:
+                m.dbsession.rollback()
+                print('Error in "{0}": {1}'.format(line, e))
+            duration = time.monotonic() - started_at
+            timings.append((line, '{:.3f}s'.format(duration)))
+            print('{0} took {1:.3f}s'.format(methodname, duration))
+    finally:
+        m.command_source = None
+    m.emit(['Command', 'Time'], timings)
+
+def serve_session(m, path):
+    """
+    Accept connections on the Unix socket at path and run each connection's lines as a session.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+    print('Serving session on {0}'.format(path))
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                with conn, conn.makefile('r') as rfile, conn.makefile('w', buffering=1) as wfile:
+                    with redirect_stdout(wfile):
+                        run_session(m, rfile)
+            except OSError as e:
+                # a client that hung up (BrokenPipeError, ConnectionResetError) ends its own session only
+                m.dbsession.rollback()
+                print('Session aborted: {0!r}'.format(e))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(path)
+
+def fanout_worker(profile, methodname, userargs, options):
+    # runs in its own process: one Manager, engine and stdout per environment
+    started_at = time.monotonic()
+    printed = io.StringIO()
+    collected = []
+    error = None
+    try:
+        with redirect_stdout(printed):
+            m = Manager(profile=profile, **options)
+            m.collected = collected
+            dispatch(m, methodname, userargs)
+    except Exception as e:
+        error = repr(e)
+    return profile, collected, printed.getvalue(), error, time.monotonic() - started_at
+
+def fanout(profiles, methodname, userargs = None, output = 'table', **options):
+    """
+    Run one Manager method against every connection profile concurrently and write one combined table per
+    result layout with an Environment column. Everything else a method prints (headings, totals) is combined
+    line by line into an Output table.
+    """
+    with ProcessPoolExecutor(max_workers=len(profiles)) as executor:
+        results = list(executor.map(fanout_worker, profiles, repeat(methodname), repeat(userargs), repeat(options)))
+
+    tables = {}
+    timings = []
+    for profile, collected, printed, error, duration in results:
+        timings.append((profile, '{:.3f}s'.format(duration), error or ''))
+        for titles, rows in collected:
+            tables.setdefault(tuple(titles), []).extend([profile] + list(row) for row in rows)
+        if error is None:
+            tables.setdefault(('Output',), []).extend([profile, line] for line in printed.splitlines() if line)
+    for titles, rows in tables.items():
+        output_stream(['Environment'] + list(titles), rows, output)
+    output_stream(['Environment', 'Time', 'Error'], timings, output)
 
 def main(argv):
     started_at = time.monotonic()
-    m = Manager()
 
     try:
-        opts, args = getopt.getopt(argv, "hm:p:",["method=","parameters="])
+        opts, args = getopt.getopt(argv, "hm:p:rwlo:s:c:e:",["method=","parameters=","refresh-schema","wallet-cache","local","output=","session=","socket=","cache=","profile=","explain=","envs=","memory-budget="])
     except getopt.GetoptError:
         print('tyc.py -m support_analyze -p 3310')
         sys.exit(2)
 
     userargs = None
+    refresh_schema = False
+    wallet_cache = False
+    local = False
+    output = 'table'
+    session = None
+    socket_path = None
+    cache_ttl = None
+    profile_path = None
+    explain_slowest = None
+    envs = None
+    memory_budget = None
 
     for opt, arg in opts:
         if opt == "-h":
@@ -396,11 +1477,64 @@ def main(argv):
             methodname = arg
         elif opt in ("-p", "--parameters"):
             userargs = arg
+        elif opt in ("-r", "--refresh-schema"):
+            refresh_schema = True
+        elif opt in ("-w", "--wallet-cache"):
+            wallet_cache = True
+        elif opt in ("-l", "--local"):
+            local = True
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt in ("-s", "--session"):
+            session = arg
+        elif opt == "--socket":
+            socket_path = arg
+        elif opt in ("-c", "--cache"):
+            # -c <ttl seconds>
+            cache_ttl = float(arg)
+        elif opt == "--profile":
+            # --profile <json file>, '-' to only print the summary
+            profile_path = arg
+        elif opt == "--explain":
+            # --explain <number of slowest statements to capture the query plan of>
+            explain_slowest = int(arg)
+        elif opt in ("-e", "--envs"):
+            # -e prod,staging runs the method against .env.prod and .env.staging, -e all against every .env.<name>
+            envs = list_profiles() if arg == 'all' else arg.split(',')
+        elif opt == "--memory-budget":
+            # --memory-budget <MiB>
+            memory_budget = int(float(arg) * 1024 * 1024)
+
+    if envs:
+        # every environment runs in its own process on its own profile, none of these apply there
+        ignored = [flag for flag, value in (('-l', local), ('-c', cache_ttl is not None), ('-s', session), ('--socket', socket_path),
+            ('--profile', profile_path), ('--explain', explain_slowest)) if value]
+        if ignored:
+            print('-e cannot be combined with {0}'.format(', '.join(ignored)))
+            sys.exit(2)
+        fanout(envs, methodname, userargs, output, refresh_schema=refresh_schema, wallet_cache=wallet_cache, memory_budget=memory_budget)
+        duration = time.monotonic() - started_at
+        print(f'Elapsed time: {duration/60:.2f} minutes')
+        return
 
-    if userargs:
-        getattr(m, methodname)(userargs)
+    result_cache = None
+    if cache_ttl is not None:
+        result_cache = ResultCache(ttl=cache_ttl)
+        atexit.register(result_cache.report)
+
+    m = Manager(refresh_schema=refresh_schema, wallet_cache=wallet_cache, local=local, output=output, result_cache=result_cache, memory_budget=memory_budget)
+    if profile_path or explain_slowest:
+        # statements of the schema fingerprint and reflection above are not profiled
+        m.profiler = QueryProfiler(m.engine, explain_slowest or 0)
+
+    # a session runs many commands on this one Manager, its engine and connection pool
+    if socket_path:
+        serve_session(m, socket_path)
+    elif session:
+        with (nullcontext(sys.stdin) if session == '-' else open(session)) as f:
+            run_session(m, f)
     else:
-        getattr(m, methodname)()
+        dispatch(m, methodname, userargs)
 
     # m.get_users_follow_allowed()
     # m.get_followers_of_trader("Moneyguru")
@@ -410,6 +1544,9 @@ def main(argv):
     # m.get_top_traders_balance(10)
     # m.get_top_followers_balance(10)
 
+    if m.profiler is not None:
+        m.profiler.finish(None if profile_path == '-' else profile_path)
+
     duration = time.monotonic() - started_at
     duration_minutes = duration/60
     print(f'Elapsed time: {duration_minutes:.2f} minutes')
@@ -0,0 +1,287 @@
+import sys, getopt
+import os
+import io
+import time
+import sqlite3
+import tracemalloc
+from contextlib import redirect_stdout
+from sqlalchemy import create_engine, func, MetaData, Table, Column, Index, Integer, Float, String, Boolean, DateTime
+from sqlalchemy.pool import QueuePool
+import numpy as np
+from tyc import Manager, output_stream, ROLE_TRADER, ROLE_FOLLOWER
+
+# Benchmark of every report method of tyc.Manager against a synthetic SQLite database, no production access needed.
+# python tyc_bench.py -d tyc_bench.db -u 100000 -e 50000000 -n 5
+
+BENCH_DB_PATH = 'tyc_bench.db'
+BENCH_USERS = 10000
+BENCH_EVENTS = 1000000
+BENCH_DAYS = 365
+BENCH_REPEAT = 5
+INSERT_BATCH_SIZE = 100000
+TRADER_SHARE = 0.05
+START_DATE = np.datetime64('2022-01-01T00:00:00')
+
+def synthetic_metadata():
+    # the columns of the production tables tyc.py reads; no foreign keys so automap stays as simple as on production
+    metadata = MetaData()
+    Table('User', metadata,
+        Column('Id', Integer, primary_key=True),
+        Column('UserName', String(64)),
+        Column('Email', String(128)),
+        Column('EmailConfirmed', Boolean),
+        Column('Deleted', Boolean),
+        Column('IsKycDone', Boolean),
+        Column('IsBasisKycDone', Boolean),
+        Column('IsFollowingAllowed', Boolean),
+        Column('DateCreated', DateTime),
+        Index('ix_User_UserName', 'UserName'),
+        Index('ix_User_Email', 'Email'))
+    Table('UserRole', metadata,
+        Column('UserId', Integer, primary_key=True),
+        Column('RoleId', Integer, primary_key=True))
+    Table('Follower', metadata,
+        Column('Id', Integer, primary_key=True),
+        Column('FollowedById', Integer),
+        Column('FollowedUserId', Integer),
+        Column('FollowAmount', Float),
+        Column('Deleted', Boolean),
+        Column('DateCreated', DateTime),
+        Index('ix_Follower_FollowedUserId', 'FollowedUserId'))
+    Table('BinanceMirrorEventLogs', metadata,
+        Column('Id', Integer, primary_key=True),
+        Column('UserId', Integer),
+        Column('ExchangeTimeStamp', DateTime),
+        Column('DateCreated', DateTime),
+        Column('DerivedUsdtValue', Float),
+        Column('DerivedTradeVolume', Float),
+        Column('DerivedPositionLnGrowth', Float),
+        Index('ix_BinanceMirrorEventLogs_UserId_ExchangeTimeStamp', 'UserId', 'ExchangeTimeStamp'))
+    Table('Wallet', metadata,
+        Column('Id', Integer, primary_key=True),
+        Column('UserId', Integer),
+        Column('WalletType', Integer),
+        Index('ix_Wallet_UserId', 'UserId'))
+    Table('Transaction', metadata,
+        Column('Id', Integer, primary_key=True),
+        Column('WalletId', Integer),
+        Column('Amount', Float),
+        Column('TransactionType', Integer),
+        Column('WalletType', Integer),
+        Index('ix_Transaction_WalletId', 'WalletId'))
+    Table('KycAttempts', metadata,
+        Column('Id', Integer, primary_key=True),
+        Column('UserId', Integer),
+        Column('BasisIdStatus', Integer),
+        Column('DateCreated', DateTime),
+        Index('ix_KycAttempts_UserId', 'UserId'))
+    return metadata
+
+def timestamps(rng, n, days):
+    # SQLAlchemy's SQLite DateTime format, 'YYYY-MM-DD HH:MM:SS.ffffff'
+    seconds = rng.integers(0, days * 86400, n).astype('timedelta64[s]')
+    return np.char.replace(np.datetime_as_string(START_DATE + seconds, unit='us'), 'T', ' ')
+
+def insert_rows(conn, table, columns):
+    n = len(columns[0])
+    sql = 'insert into "{0}" values ({1})'.format(table, ', '.join('?' * len(columns)))
+    for start in range(0, n, INSERT_BATCH_SIZE):
+        conn.executemany(sql, zip(*[c[start:start + INSERT_BATCH_SIZE].tolist() for c in columns]))
+    conn.commit()
+
+def generate(path, users = BENCH_USERS, events = BENCH_EVENTS, days = BENCH_DAYS, seed = 42):
+    """
+    Write a synthetic TYC database with `users` users and `events` BinanceMirrorEventLogs rows to path.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    metadata = synthetic_metadata()
+    engine = create_engine('sqlite:///{0}'.format(path))
+    metadata.create_all(engine)
+    engine.dispose()
+
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, users + 1)
+    traders = ids[rng.random(users) < TRADER_SHARE]
+    is_trader = np.isin(ids, traders)
+    conn = sqlite3.connect(path)
+    conn.execute('pragma journal_mode = off')
+    conn.execute('pragma synchronous = off')
+
+    insert_rows(conn, 'User', [ids, np.char.add('user', ids.astype(str)), np.char.add(np.char.add('user', ids.astype(str)), '@example.org'),
+        rng.random(users) < 0.9, rng.random(users) < 0.02, rng.random(users) < 0.3, rng.random(users) < 0.5,
+        rng.random(users) < 0.8, timestamps(rng, users, days)])
+    insert_rows(conn, 'UserRole', [ids, np.where(is_trader, ROLE_TRADER, ROLE_FOLLOWER)])
+
+    followers = ids[~is_trader]
+    n_follow = int(len(followers) * 1.2)
+    insert_rows(conn, 'Follower', [np.arange(1, n_follow + 1), rng.choice(followers, n_follow), rng.choice(traders, n_follow),
+        np.round(rng.uniform(50, 5000, n_follow), 2), rng.random(n_follow) < 0.1, timestamps(rng, n_follow, days)])
+
+    for start in range(0, events, INSERT_BATCH_SIZE):
+        n = min(INSERT_BATCH_SIZE, events - start)
+        insert_rows(conn, 'BinanceMirrorEventLogs', [np.arange(start + 1, start + n + 1), rng.choice(ids, n),
+            timestamps(rng, n, days), timestamps(rng, n, days), rng.lognormal(7, 1.5, n),
+            rng.lognormal(5, 2, n), rng.normal(0, 0.01, n)])
+
+    n_wallets = users * 2
+    wallet_users = np.repeat(ids, 2)
+    insert_rows(conn, 'Wallet', [np.arange(1, n_wallets + 1), wallet_users, rng.integers(0, 3, n_wallets)])
+    n_transactions = users * 5
+    transaction_types = rng.integers(0, 4, n_transactions)
+    amounts = np.round(rng.uniform(1, 1000, n_transactions), 2)
+    insert_rows(conn, 'Transaction', [np.arange(1, n_transactions + 1), rng.integers(1, n_wallets + 1, n_transactions),
+        np.where(transaction_types == 1, -amounts, amounts), transaction_types, rng.integers(0, 3, n_transactions)])
+    n_kyc = int(users * 1.5)
+    insert_rows(conn, 'KycAttempts', [np.arange(1, n_kyc + 1), rng.choice(ids, n_kyc), rng.integers(0, 11, n_kyc), timestamps(rng, n_kyc, days)])
+    conn.execute('analyze')
+    conn.close()
+
+class CountingCursor(sqlite3.Cursor):
+    rows_fetched = 0
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            CountingCursor.rows_fetched += 1
+        return row
+
+    def fetchmany(self, size = None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        CountingCursor.rows_fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        CountingCursor.rows_fetched += len(rows)
+        return rows
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory = None):
+        return super().cursor(factory or CountingCursor)
+
+def counting_engine(path):
+    return create_engine('sqlite://', poolclass=QueuePool,
+        creator=lambda: sqlite3.connect(path, factory=CountingConnection, check_same_thread=False))
+
+def bench_calls(m, emails_path):
+    trader, = m.dbsession.query(m.tbl_user.UserName).\
+        join(m.tbl_follower, m.tbl_follower.FollowedUserId==m.tbl_user.Id).\
+        group_by(m.tbl_user.UserName).\
+        order_by(func.count(m.tbl_follower.Id).desc()).first()
+    email = '{0}@example.org'.format(trader)
+    return [
+        ('get_users_follow_allowed', []),
+        ('get_followers_of_trader', [trader]),
+        ('get_profitloss_alltime', [trader]),
+        ('get_top_traders_profitloss', ['10']),
+        ('get_equity_curves', [trader]),
+        ('get_hourly_profitloss', [trader]),
+        ('get_top_traders_volume', ['10']),
+        ('get_top_followers_volume', ['10']),
+        ('get_top_traders_balance', ['10']),
+        ('get_top_followers_balance_max', ['10']),
+        ('get_top_followers_balance', ['10']),
+        ('get_cnt_user_with_withdrawals', []),
+        ('get_cnt_users_basisid_kyc', []),
+        ('get_cnt_users_basisid_kyc_with_balance', []),
+        ('get_cnt_users_basisid_kyc_withdrawn_all', []),
+        ('get_sum_unlocked_tyc_wallets', []),
+        ('get_cnt_users', []),
+        ('get_last_activity', [trader]),
+        ('get_event_history', [trader]),
+        ('get_network_stats', ['10']),
+        ('get_network_followers', [trader]),
+        ('get_slt_general_status', ['single']),
+        ('get_slt_general_status', ['parallel']),
+        ('get_slt_general_status', ['sequential']),
+        ('supp_check', [email]),
+        ('supp_check_bulk', [emails_path]),
+    ]
+
+def reset_caches(m):
+    # every measured call pays for the in-process graph and wallet table it needs
+    m._follow_graph = None
+    m._wallet_table = None
+
+def measure(m, methodname, args, repeat):
+    method = getattr(m, methodname)
+    latencies = []
+    for i in range(repeat):
+        reset_caches(m)
+        started_at = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            method(*args)
+        latencies.append(time.perf_counter() - started_at)
+    # rows and memory come from an extra run so tracemalloc does not distort the timings
+    reset_caches(m)
+    rows_before = CountingCursor.rows_fetched
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()):
+        method(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return np.array(latencies) * 1000, CountingCursor.rows_fetched - rows_before, peak
+
+def run(path, repeat = BENCH_REPEAT):
+    m = Manager(engine=counting_engine(path), output='csv')
+    emails_path = path + '.emails'
+    with open(emails_path, 'w') as f:
+        for username, in m.dbsession.query(m.tbl_user.UserName).limit(500):
+            f.write('{0}@example.org\n'.format(username))
+
+    calls = bench_calls(m, emails_path)
+    covered = {methodname for methodname, args in calls}
+    missing = sorted(name for name in dir(m) if name.startswith(('get_', 'supp_check')) and not name.endswith('_rows') and callable(getattr(m, name)) and name not in covered)
+    if missing:
+        print('Not benchmarked: {0}'.format(', '.join(missing)))
+
+    results = []
+    for methodname, args in calls:
+        latencies, rows, peak = measure(m, methodname, args, repeat)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        results.append((methodname, ','.join(args)[:24], '{:.1f}'.format(p50), '{:.1f}'.format(p90), '{:.1f}'.format(p99),
+            '{:.1f}'.format(latencies.max()), rows, '{:.2f}'.format(peak / 1024 / 1024)))
+        m.dbsession.rollback()
+    os.remove(emails_path)
+    output_stream(['Method', 'Parameters', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'Rows', 'Peak MiB'], results)
+
+def main(argv):
+    usage = 'tyc_bench.py -d tyc_bench.db -u 10000 -e 1000000 -n 5 [-g]'
+    try:
+        opts, args = getopt.getopt(argv, "hd:u:e:n:g",["database=","users=","events=","repeat=","generate"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    path = BENCH_DB_PATH
+    users = BENCH_USERS
+    events = BENCH_EVENTS
+    repeat = BENCH_REPEAT
+    regenerate = False
+
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt in ("-d", "--database"):
+            path = arg
+        elif opt in ("-u", "--users"):
+            users = int(arg)
+        elif opt in ("-e", "--events"):
+            events = int(arg)
+        elif opt in ("-n", "--repeat"):
+            repeat = int(arg)
+        elif opt in ("-g", "--generate"):
+            regenerate = True
+
+    if regenerate or not os.path.exists(path):
+        started_at = time.monotonic()
+        print('Generating {0} users and {1} event log rows into {2}'.format(users, events, path))
+        generate(path, users, events)
+        print('Generated in {0:.1f}s'.format(time.monotonic() - started_at))
+
+    run(path, repeat)
+
+if __name__ == "__main__":
+   main(sys.argv[1:])